@@ -6,8 +6,10 @@ from can import Message
 from can.interface import Bus
 
 from CANHandler import CANHandler
+from Cluster import ClusterCoordinator
+from LatencyTracer import LatencyTracer, Trace
 from MQTTHandler import MQTTHandler
-from util import MQTTParams, CANParams, Mapping
+from util import MQTTParams, CANParams, TraceParams, ClusterParams, Mapping
 
 
 def _logConsole(message: str):
@@ -24,13 +26,16 @@ def _logConsole(message: str):
 class Bridge:
     """The Bridge between CAN and MQTT"""
 
-    def __init__(self, mqttParams: MQTTParams, canParams: CANParams, mappings: list[Mapping]):
+    def __init__(self, mqttParams: MQTTParams, canParams: CANParams, mappings: list[Mapping],
+                 traceParams: TraceParams = None, clusterParams: ClusterParams = None):
         """
         Create a Bridge instance with the given params for both handlers and the mappings.
 
         :param mqttParams: The params needed for the MQTTHandler
         :param canParams: The params needed for the CANHandler
         :param mappings: A list of mappings between CAN-ID and MQTT-Topic
+        :param traceParams: The params needed for the LatencyTracer. Tracing is disabled if not given.
+        :param clusterParams: The params needed for the ClusterCoordinator. Clustered mode is disabled if not given.
         """
 
         if len(mappings) <= 0:
@@ -41,20 +46,45 @@ class Bridge:
 
         self.mappings = mappings
 
+        if traceParams is None:
+            traceParams = TraceParams()
+
+        if clusterParams is None:
+            clusterParams = ClusterParams()
+
+        self.__initialized = False
+
+        # Create the LatencyTracer shared by both handlers
+        self._tracer = LatencyTracer(traceParams.sampleRate, traceParams.spanFile)
+
         # Create the MQTTHandler
         self._mqttHandler = MQTTHandler(
             self._sendMessageToCAN,
             mqttParams.hostname, mqttParams.port, mqttParams.username, mqttParams.password,
-            mappings
+            mappings, self._tracer,
+            clusterParams.instanceID if clusterParams.group else None, clusterParams.group,
+            self._onMQTTConnected
         )
 
         # Create the CANHandler
         self._canHandler = CANHandler(
             self._sendMessageToMQTT,
             canParams.channel, canParams.interface, canParams.bustype, canParams.bitrate,
-            mappings
+            mappings, canParams.deadline, self._tracer
         )
 
+        # Create the ClusterCoordinator, which partitions the mappings between the instances of the group
+        self._coordinator = None
+        if clusterParams.group:
+            self._coordinator = ClusterCoordinator(
+                self._mqttHandler.client, clusterParams.group, clusterParams.instanceID, mappings,
+                self._onOwnershipChanged
+            )
+            self._coordinator.prepare()
+
+            # Forward nothing until the ownership is known
+            self._canHandler.ownedIDs = set()
+
         if self._mqttHandler.connect() and not self._canHandler.abort:
             # Start a thread for the loop of the MQTTHandler
             self.__mqttThread = Thread(target=self._mqttHandler.client.loop_forever)
@@ -67,7 +97,8 @@ class Bridge:
                 if self._mqttHandler.abort:
                     self.stop()
 
-            self._mqttHandler.initHandler()
+            self.__initSubscriptions()
+            self.__initialized = True
 
             # Init the abort listener thread
             self.__listenForAbort = True
@@ -81,6 +112,36 @@ class Bridge:
         else:
             self.stop()
 
+    def __initSubscriptions(self):
+        """
+        Subscribes to the mapped topics and joins the bridge group in clustered mode. Has to be repeated after every
+        reconnect, since the broker forgets the subscriptions of a clean session.
+
+        :return: Nothing
+        """
+
+        if self._coordinator is None:
+            self._mqttHandler.initHandler()
+        else:
+            # Forward nothing until the own announcement returns and the ownership is known again
+            self._canHandler.ownedIDs = set()
+            self._mqttHandler.initHandler(self._coordinator.ownedMappings())
+            self._coordinator.join()
+
+    def _onMQTTConnected(self):
+        """
+        Common ground to restore the subscriptions once the MQTTHandler reconnected to the broker.
+
+        :return: Nothing
+        """
+
+        if not self.__initialized:
+            return
+
+        _logConsole("Reconnected to the MQTT Broker! Restoring subscriptions...")
+
+        self.__initSubscriptions()
+
     def __abortListener(self):
         """
         Checks if any of the handlers set the abort flag and stop the bridge. The loop can be interrupted by setting
@@ -108,6 +169,10 @@ class Bridge:
         except (AttributeError, RuntimeError):
             pass
 
+        # Leave the group, so the other instances take over
+        if self._coordinator is not None:
+            self._coordinator.leave()
+
         # Stop the MQTTHandler
         self._mqttHandler.stop()
         try:
@@ -118,36 +183,57 @@ class Bridge:
         # Stop the CANHandler
         self._canHandler.stop()
 
+        self._tracer.stop()
+
         _logConsole("Stopped!")
 
         exit(0)
 
-    def _sendMessageToCAN(self, canID: int, payload):
+    def _onOwnershipChanged(self, ownedMappings: list[Mapping]):
+        """
+        Common ground to apply the mappings this instance owns within its bridge group.
+
+        :param ownedMappings: The mappings this instance is responsible for
+        :return: Nothing
+        """
+
+        self._canHandler.ownedIDs = {mapping.canID for mapping in ownedMappings}
+        self._mqttHandler.updateSubscriptions(ownedMappings)
+
+    def _sendMessageToCAN(self, canID: int, payload, trace: Trace = None):
         """
         Common ground to send a message from MQTT to CAN.
 
         :param canID: The CAN-ID the message should be sent on
         :param payload: The payload of the message
         :type payload: bytearray[int] | list[int]
+        :param trace: The latency trace of the message, if it is sampled.
         :return: Nothing
         """
 
         _logConsole("Forwarding from MQTT to CAN.")
 
-        self._canHandler.sendMessage(canID, payload)
+        try:
+            self._canHandler.queueMessage(canID, payload, trace)
+        except (ValueError, OverflowError) as e:
+            _logConsole(f"Message for CAN-ID '{canID}' is invalid: {e}")
+
+            if trace is not None:
+                trace.finish("invalid")
 
-    def _sendMessageToMQTT(self, topic: str, payload):
+    def _sendMessageToMQTT(self, topic: str, payload, trace: Trace = None):
         """
         Common ground to send a message from the CAN to MQTT.
 
         :param topic: The MQTT Topic
         :param payload: The payload of the message
+        :param trace: The latency trace of the message, if it is sampled.
         :return: Nothing
         """
 
         _logConsole("Forwarding from CAN to MQTT.")
 
-        self._mqttHandler.publishMessage(topic, payload)
+        self._mqttHandler.publishMessage(topic, payload, trace)
 
     def testConnectivity(self):
         """
@@ -1,7 +1,10 @@
 from can import Message, Listener, Notifier
 from can.interface import Bus
 
-from util import Mapping, MAX_EXTENDED_CAN_ID, MAX_CAN_ID, BYTE_ORDER
+from IsoTP import IsoTPTransport
+from LatencyTracer import LatencyTracer, Trace, CAN_TO_MQTT
+from TransmitScheduler import TransmitScheduler
+from util import Mapping, MAX_EXTENDED_CAN_ID, MAX_CAN_ID, BYTE_ORDER, TRANSPORT_ISO_TP
 
 
 def beautifyBytearray(array: bytearray):
@@ -31,7 +34,8 @@ class CANHandler:
     """Handles the communication with a (virtual) CAN Bus"""
 
     def __init__(self, sendToMQTT, channel="Virtual CAN Bus", interface="virtual", bustype="virtual",
-                 bitrate=500000, mappings: list[Mapping] = None):
+                 bitrate=500000, mappings: list[Mapping] = None, deadline: float = 1.0,
+                 tracer: LatencyTracer = None):
         """
         Creates a CANHandler instance.
 
@@ -41,6 +45,8 @@ class CANHandler:
         :param bustype: The bustype. 'virtual' for a virtual CAN Bus.
         :param bitrate: The bitrate of the CAN Bus. Not needed for a virtual CAN.
         :param mappings: A list of CAN-IDs to react to.
+        :param deadline: The default duration (in s) a queued message may wait before it is dropped.
+        :param tracer: The tracer which samples the latency of messages. Tracing is disabled if not given.
         """
 
         if channel is None:
@@ -58,11 +64,34 @@ class CANHandler:
         if mappings is None:
             mappings = []
 
+        if tracer is None:
+            tracer = LatencyTracer()
+
         self._sendToMQTT = sendToMQTT
         self.mappings = mappings
+        self.tracer = tracer
+
+        # The CAN-IDs this instance forwards to MQTT. None forwards every mapped CAN-ID
+        self.ownedIDs = None
 
         self.abort = False
 
+        # Messages from MQTT are queued and sent on the scheduler's thread
+        self.__scheduler = TransmitScheduler(self.__transmit, deadline)
+
+        # Mappings with segmented payloads bypass the scheduler and use their own ISO-TP transport
+        self.__isoTPTransports = {
+            mapping.canID: IsoTPTransport(mapping, self.__sendFrame, self.__segmentedMessageReceived, deadline)
+            for mapping in mappings if mapping.transport == TRANSPORT_ISO_TP
+        }
+        self.__responseTransports = {
+            transport.mapping.responseID: transport for transport in self.__isoTPTransports.values()
+        }
+
+        if not self.__checkResponseIDs(mappings):
+            self.abort = True
+            return
+
         _logConsole("Opening CAN Bus...")
 
         if bustype == "virtual" or interface == "virtual" or channel == "Virtual CAN Bus":
@@ -96,6 +125,11 @@ class CANHandler:
 
             self.__notifier = Notifier(self._canBus, [listener], 0)
 
+            self.__scheduler.start()
+
+            for transport in self.__isoTPTransports.values():
+                transport.start()
+
             _logConsole("CANHandler initialized!")
         else:
             _logConsole("Check failed!")
@@ -108,15 +142,58 @@ class CANHandler:
         :return: Nothing.
         """
 
+        self.__scheduler.stop()
+
+        for transport in self.__isoTPTransports.values():
+            transport.stop()
+
         try:
             self.__notifier.stop()
         except AttributeError:
             pass
 
-        self._canBus.shutdown()
+        try:
+            self._canBus.shutdown()
+        except AttributeError:
+            pass
 
         _logConsole("Stopped!")
 
+    @staticmethod
+    def __checkResponseIDs(mappings: list[Mapping]):
+        """
+        Checks that every ISO-TP mapping has a response ID of its own. Frames on a response ID are dispatched to the
+        ISO-TP transport before anything else, so a shared response ID would silently break one of the mappings.
+
+        :param mappings: All mappings
+        :return: True, if no response ID is used twice or as the CAN-ID of a mapping
+        """
+
+        canIDs = {mapping.canID for mapping in mappings}
+        responseIDs = set()
+
+        for mapping in mappings:
+            if mapping.transport != TRANSPORT_ISO_TP:
+                continue
+
+            if mapping.responseID in responseIDs:
+                _logConsole(
+                    f"The Response-ID '{hex(mapping.responseID)}' of CAN-ID '{hex(mapping.canID)}' is used by "
+                    f"another ISO-TP mapping! Check the mapping file contents!"
+                )
+                return False
+
+            if mapping.responseID in canIDs:
+                _logConsole(
+                    f"The Response-ID '{hex(mapping.responseID)}' of CAN-ID '{hex(mapping.canID)}' is the "
+                    f"CAN-ID of another mapping! Check the mapping file contents!"
+                )
+                return False
+
+            responseIDs.add(mapping.responseID)
+
+        return True
+
     def __messageReceived(self, canMessage: Message):
         """
         This method is called every time a message was sent to the CAN Bus.
@@ -127,6 +204,26 @@ class CANHandler:
 
         canID = canMessage.arbitration_id
 
+        if canID in self.__responseTransports:
+            transport = self.__responseTransports[canID]
+
+            if self.ownedIDs is None or transport.mapping.canID in self.ownedIDs:
+                transport.frameReceived(canMessage.data, canMessage.timestamp)
+            else:
+                # Only the owner reassembles, but flow control may answer a transfer of this instance
+                transport.flowControlReceived(canMessage.data)
+            return
+
+        if canID in self.__isoTPTransports:
+            # Frames the Bridge (or another instance of its group) sent to an ISO-TP peer
+            return
+
+        if self.ownedIDs is not None and canID not in self.ownedIDs:
+            # Another instance of the bridge group forwards this CAN-ID
+            return
+
+        trace = self.tracer.startTrace(CAN_TO_MQTT, canMessage.timestamp)
+
         # Extend data to 8 bytes
         canMessage.data.extend([0 for _ in range(0, 8 - canMessage.dlc)])
 
@@ -139,15 +236,71 @@ class CANHandler:
             # Get corresponding MQTT topic
             topic = [mapping.mqttTopic for mapping in self.mappings if canID == mapping.canID][0]
 
+            if trace is not None:
+                trace.mark("routed")
+
             _logConsole(f"This message will be forwarded to MQTT-Topic '{topic}' (payload: '{payload}')!")
 
-            self._sendToMQTT(topic, payload)
+            self._sendToMQTT(topic, payload, trace)
         except IndexError:
             _logConsole(f"No MQTT-Topic for CAN-ID '{hex(canID)}' found!")
 
+            if trace is not None:
+                trace.finish("unmapped")
+
+    def __segmentedMessageReceived(self, mapping: Mapping, payload: bytes, timestamp: float):
+        """
+        This method is called every time an ISO-TP transport reassembled a payload.
+
+        :param mapping: The mapping of the transport
+        :param payload: The reassembled payload
+        :param timestamp: The timestamp of the last frame
+        :return: Nothing
+        """
+
+        trace = self.tracer.startTrace(CAN_TO_MQTT, timestamp)
+
+        _logConsole(
+            f"Received {len(payload)} bytes via ISO-TP on ID '{hex(mapping.canID)}'! They will be forwarded to "
+            f"MQTT-Topic '{mapping.mqttTopic}'!"
+        )
+
+        if trace is not None:
+            trace.mark("routed")
+
+        self._sendToMQTT(mapping.mqttTopic, payload, trace)
+
+    def queueMessage(self, canID: int, payload, trace: Trace = None):
+        """
+        Queue a message for the CAN Bus. The message is sent by the transmit scheduler in priority order and dropped
+        if it can't be sent before its deadline. A pending message with the same CAN-ID is replaced.
+        Payloads of ISO-TP mappings are segmented and sent in order by the transport of the mapping instead.
+
+        :param canID: The CAN-ID of the message
+        :param payload: The payload of the message. Can be both a bytearray or a list.
+        :type payload: bytearray[int] | list[int] | bytes
+        :param trace: The latency trace of the message, if it is sampled.
+        :return: Nothing
+        :raises ValueError: if any of the given data bytes in the payload exceed the range (0, 256)
+        :raises ValueError: if the CAN-ID is invalid. Maximum allowed ID is 2^29 - 1
+        :raises OverflowError: if the payload is too long for ISO-TP
+        """
+
+        if canID in self.__isoTPTransports:
+            self.__isoTPTransports[canID].queue(payload, trace)
+            return
+
+        payload = self.__validateMessage(canID, payload)
+
+        mapping = next((mapping for mapping in self.mappings if mapping.canID == canID), None)
+        if mapping is None:
+            self.__scheduler.schedule(canID, payload, trace=trace)
+        else:
+            self.__scheduler.schedule(canID, payload, mapping.priority, mapping.deadline, trace)
+
     def sendMessage(self, canID: int, payload, timeout: float = 1.0):
         """
-        Send a message to the CAN Bus.
+        Send a message to the CAN Bus immediately, bypassing the transmit scheduler.
 
         :param canID: The CAN-ID of the message
         :param payload: The payload of the message. Can be both a bytearray or a list.
@@ -159,6 +312,21 @@ class CANHandler:
         :raises ValueError: if the CAN-ID is invalid. Maximum allowed ID is 2^29 - 1
         """
 
+        self.__transmit(canID, self.__validateMessage(canID, payload), timeout)
+
+    @staticmethod
+    def __validateMessage(canID: int, payload):
+        """
+        Checks the CAN-ID and the payload of a message.
+
+        :param canID: The CAN-ID of the message
+        :param payload: The payload of the message
+        :type payload: bytearray[int] | list[int]
+        :return: The payload as a bytearray, if it was given as a list
+        :raises ValueError: if any of the given data bytes in the payload exceed the range (0, 256)
+        :raises ValueError: if the CAN-ID is invalid. Maximum allowed ID is 2^29 - 1
+        """
+
         if isinstance(payload, list):
             if any([number > 0xff for number in payload]):
                 raise ValueError(
@@ -170,6 +338,32 @@ class CANHandler:
         if not isinstance(canID, int) or canID > MAX_EXTENDED_CAN_ID:
             raise ValueError(f"Invalid CAN-ID! The maximum allowed ID is {hex(MAX_EXTENDED_CAN_ID)}")
 
+        return payload
+
+    def __transmit(self, canID: int, payload, timeout: float):
+        """
+        Puts an already validated message on the CAN Bus.
+
+        :param canID: The CAN-ID of the message
+        :param payload: The payload of the message
+        :type payload: bytearray[int] | bytes
+        :param timeout: The duration (in s) which will be waited for in order for the message to be delivered.
+        :return: Nothing
+        """
+
         _logConsole(f"Sending message with payload '{beautifyBytearray(payload)}' to CAN-ID '{hex(canID)}'.")
 
+        self.__sendFrame(canID, payload, timeout)
+
+    def __sendFrame(self, canID: int, payload, timeout: float):
+        """
+        Puts an already validated message on the CAN Bus without logging it. Used for the frames of ISO-TP transfers.
+
+        :param canID: The CAN-ID of the message
+        :param payload: The payload of the message
+        :type payload: bytearray[int] | bytes
+        :param timeout: The duration (in s) which will be waited for in order for the message to be delivered.
+        :return: Nothing
+        """
+
         self._canBus.send(Message(arbitration_id=canID, data=payload, extended_id=canID > MAX_CAN_ID), timeout)
@@ -0,0 +1,208 @@
+import hashlib
+import uuid
+from bisect import bisect
+from threading import Lock
+
+from paho.mqtt.client import Client, MQTTMessage
+
+from util import Mapping
+
+CLUSTER_TOPIC_PREFIX = "bridge"
+VIRTUAL_NODES = 64
+
+
+def _logConsole(message: str):
+    """
+    Prints a message with a "[Cluster]: " prefix
+
+    :param message: The message to print
+    :return: Nothing
+    """
+
+    print(f"[Cluster]: {message}")
+
+
+def _hash(key: str):
+    """
+    Hashes a key onto the ring. Unlike hash(), the result is the same in every process.
+
+    :param key: The key to hash
+    :return: The position of the key on the ring
+    """
+
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], byteorder="big")
+
+
+class HashRing:
+    """Assigns keys to instances by consistent hashing, so only a small share of keys moves if an instance joins"""
+
+    def __init__(self, instances, virtualNodes: int = VIRTUAL_NODES):
+        """
+        Creates a HashRing with the given instances.
+
+        :param instances: The IDs of the instances on the ring
+        :type instances: set[str] | list[str]
+        :param virtualNodes: The number of points per instance on the ring. More points spread the keys more evenly.
+        """
+
+        self.__points = sorted(
+            (_hash(f"{instance}#{node}"), instance) for instance in instances for node in range(virtualNodes)
+        )
+        self.__positions = [position for position, _ in self.__points]
+
+    def owner(self, key: str):
+        """
+        Looks up the instance responsible for a key.
+
+        :param key: The key to look up
+        :return: The ID of the owning instance or None, if the ring is empty
+        """
+
+        if not self.__points:
+            return None
+
+        return self.__points[bisect(self.__positions, _hash(key)) % len(self.__points)][1]
+
+
+class ClusterCoordinator:
+    """Tracks the members of a bridge group via retained MQTT messages and partitions the mappings between them"""
+
+    def __init__(self, client: Client, group: str, instanceID: str, mappings: list[Mapping], onOwnershipChanged):
+        """
+        Creates a ClusterCoordinator. Call prepare() before connecting the client and join() once it is connected.
+
+        :param client: The MQTT client of this instance
+        :param group: The name of the bridge group
+        :param instanceID: The ID of this instance. Has to be unique within the group.
+        :param mappings: All mappings of the group
+        :param onOwnershipChanged: The function which will be called with the mappings this instance owns, every
+            time they change
+        """
+
+        self.client = client
+        self.group = group
+        self.instanceID = instanceID
+        self.mappings = mappings
+        self._onOwnershipChanged = onOwnershipChanged
+
+        self.__membersTopic = f"{CLUSTER_TOPIC_PREFIX}/{group}/members"
+        self.__ownTopic = f"{self.__membersTopic}/{instanceID}"
+
+        self.__members = set()
+        self.__joined = False
+        self.__leaving = False
+
+        # Announcement of the current join. A retained announcement of an earlier connection carries another one
+        self.__nonce = None
+        self.__owned = None
+        self.__lock = Lock()
+
+    def prepare(self):
+        """
+        Registers the last will which removes this instance from the group if its connection is lost.
+
+        :return: Nothing
+        """
+
+        self.client.will_set(self.__ownTopic, None, qos=1, retain=True)
+
+    def join(self):
+        """
+        Subscribes to the membership topics and announces this instance to the group.
+
+        :return: Nothing
+        """
+
+        _logConsole(f"Joining group '{self.group}' as '{self.instanceID}'...")
+
+        # The retained announcements are delivered again, so the members and the ownership are rebuilt from them
+        with self.__lock:
+            self.__members = set()
+            self.__joined = False
+            self.__owned = None
+            self.__nonce = uuid.uuid4().hex
+
+        self.client.message_callback_add(f"{self.__membersTopic}/+", self.__memberChanged)
+        self.client.subscribe(f"{self.__membersTopic}/+", qos=1)
+
+        # The retained announcements of the other members, including an old one of this instance, arrive before the
+        # new one. Only the new one completes the join
+        self.client.publish(self.__ownTopic, self.__nonce, qos=1, retain=True)
+
+    def ownedMappings(self):
+        """
+        Returns the mappings this instance owns.
+
+        :return: The owned mappings. Empty, if the ownership isn't known yet.
+        """
+
+        with self.__lock:
+            return list(self.__owned or [])
+
+    def leave(self, timeout: float = 1.0):
+        """
+        Removes this instance from the group, so the others take over its mappings.
+
+        :param timeout: The duration (in s) which will be waited for the removal to be delivered
+        :return: Nothing
+        """
+
+        self.__leaving = True
+        result = self.client.publish(self.__ownTopic, None, qos=1, retain=True)
+
+        try:
+            result.wait_for_publish(timeout)
+        except (RuntimeError, ValueError) as e:
+            _logConsole(f"Couldn't leave group '{self.group}': {e}")
+            return
+
+        _logConsole(f"Left group '{self.group}'!")
+
+    def __memberChanged(self, _, __, message: MQTTMessage):
+        """
+        This method is called every time an instance joins or leaves the group.
+
+        :param _: The MQTT client. Ignored.
+        :param __: The MQTT user data. Ignored.
+        :param message: The retained membership message. An empty payload means the instance left.
+        :return: Nothing
+        """
+
+        instanceID = message.topic.rsplit("/", 1)[-1]
+
+        with self.__lock:
+            if message.payload:
+                self.__members.add(instanceID)
+                _logConsole(f"Instance '{instanceID}' is a member of group '{self.group}'.")
+            else:
+                self.__members.discard(instanceID)
+                _logConsole(f"Instance '{instanceID}' left group '{self.group}'.")
+
+            if instanceID == self.instanceID:
+                if not message.payload:
+                    self.__joined = False
+
+                    # A late last will of a previous connection removed this instance, so announce it again
+                    if not self.__leaving:
+                        self.client.publish(self.__ownTopic, self.__nonce, qos=1, retain=True)
+                elif message.payload.decode("utf-8", errors="ignore") == self.__nonce:
+                    self.__joined = True
+
+            # Until the announcement of this join returns, the retained messages of the other members may be incomplete
+            if not self.__joined:
+                return
+
+            ring = HashRing(self.__members)
+            owned = [mapping for mapping in self.mappings if ring.owner(str(mapping.canID)) == self.instanceID]
+
+            if owned == self.__owned:
+                return
+
+            self.__owned = owned
+
+        _logConsole(
+            f"Rebalanced between {len(self.__members)} instance(s). This instance owns {len(owned)} of "
+            f"{len(self.mappings)} mapping(s)."
+        )
+
+        self._onOwnershipChanged(owned)
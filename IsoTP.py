@@ -0,0 +1,431 @@
+import math
+import time
+from queue import Queue
+from threading import Thread, Condition
+
+from can import CanError
+
+from LatencyTracer import Trace
+from util import Mapping
+
+# Protocol control information, the upper nibble of the first byte of every frame
+SINGLE_FRAME = 0x0
+FIRST_FRAME = 0x1
+CONSECUTIVE_FRAME = 0x2
+FLOW_CONTROL = 0x3
+
+# Flow status of a flow control frame
+CONTINUE_TO_SEND = 0x0
+WAIT = 0x1
+OVERFLOW = 0x2
+
+FRAME_LENGTH = 8
+PADDING = 0xCC
+
+# The longest payload which fits in the 12 bit length of a first frame. Longer payloads use a 32 bit length
+MAX_SHORT_LENGTH = 0xFFF
+MAX_LENGTH = 0xFFFFFFFF
+
+# Durations (in s) to wait for a flow control frame (N_Bs) and for the next consecutive frame (N_Cr)
+FLOW_CONTROL_TIMEOUT = 1.0
+CONSECUTIVE_FRAME_TIMEOUT = 1.0
+MAX_WAIT_FRAMES = 10
+
+
+def _logConsole(message: str):
+    """
+    Prints a message with a "[ISO-TP]: " prefix
+
+    :param message: The message to print
+    :return: Nothing
+    """
+
+    print(f"[ISO-TP]: {message}")
+
+
+def encodeSeparationTime(separationTime: float):
+    """
+    Converts a separation time into the STmin byte of a flow control frame. Since STmin is a minimum, the separation
+    time is rounded up to the next step, so the sender is never allowed to send faster.
+
+    :param separationTime: The minimum time (in ms) between two consecutive frames
+    :return: 0x00 - 0x7f for whole milliseconds, 0xf1 - 0xf9 for 100 - 900 µs
+    """
+
+    # Rounding first keeps float errors like 0.3 * 10 = 3.0000000000000004 from adding a step
+    if 0 < separationTime < 1:
+        steps = math.ceil(round(separationTime * 10, 6))
+
+        # 0xfa would be reserved, so everything above 900 µs is 1 ms
+        return 0xF0 + steps if steps < 10 else 0x01
+
+    return min(math.ceil(round(separationTime, 6)), 0x7F)
+
+
+def decodeSeparationTime(value: int):
+    """
+    Converts the STmin byte of a flow control frame into a separation time.
+
+    :param value: The STmin byte
+    :return: The minimum time (in s) between two consecutive frames. Reserved values mean the maximum of 127 ms.
+    """
+
+    if value <= 0x7F:
+        return value / 1000
+
+    if 0xF1 <= value <= 0xF9:
+        return (value - 0xF0) / 10000
+
+    return 0.127
+
+
+class IsoTPTransport:
+    """Segments and reassembles payloads longer than a single CAN frame according to ISO 15765-2 (ISO-TP)"""
+
+    def __init__(self, mapping: Mapping, send, onReceived, deadline: float = 1.0):
+        """
+        Creates an IsoTPTransport for a mapping. The sender thread is started with start().
+
+        :param mapping: The mapping. The Bridge sends on its CAN-ID and the peer on its response ID.
+        :param send: The function which will be called to put a single frame on the CAN Bus.
+            Called with the CAN-ID, the data and the timeout (in s).
+        :param onReceived: The function which will be called with the mapping, the reassembled payload and the
+            timestamp of the last frame.
+        :param deadline: The default duration (in s) a payload may be queued before it is dropped.
+        """
+
+        self.mapping = mapping
+        self._send = send
+        self._onReceived = onReceived
+        self.deadline = deadline if mapping.deadline is None else mapping.deadline
+
+        # Reassembly state. The buffer is allocated once, so receiving never allocates per frame
+        self.__buffer = bytearray(mapping.maxLength)
+        self.__view = memoryview(self.__buffer)
+        self.__receiving = False
+        self.__expectedLength = 0
+        self.__receivedLength = 0
+        self.__sequenceNumber = 0
+        self.__blockCount = 0
+        self.__lastFrameTime = 0.0
+
+        # Transmit state
+        self.__queue = Queue()
+        self.__thread = None
+        self.__flowControl = None
+        self.__flowControlCondition = Condition()
+
+    def start(self):
+        """
+        Starts the sender thread.
+
+        :return: Nothing
+        """
+
+        self.__thread = Thread(target=self.__sendLoop, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the sender thread after the current transfer. Payloads still queued are discarded.
+
+        :return: Nothing
+        """
+
+        while not self.__queue.empty():
+            self.__queue.get_nowait()
+
+        self.__queue.put(None)
+
+        try:
+            self.__thread.join()
+        except AttributeError:
+            pass
+
+    def queue(self, payload, trace: Trace = None):
+        """
+        Queues a payload to be segmented and sent to the CAN Bus.
+
+        :param payload: The payload of any length up to 2^32 - 1 bytes
+        :type payload: bytes | bytearray[int]
+        :param trace: The latency trace of the payload, if it is sampled.
+        :return: Nothing
+        :raises OverflowError: if the payload is too long for ISO-TP
+        """
+
+        if len(payload) > MAX_LENGTH:
+            raise OverflowError(f"The payload is longer than the maximum of {MAX_LENGTH} bytes!")
+
+        if not payload:
+            # A single frame without data is invalid and would be dropped by the receiver
+            _logConsole(f"Skipped an empty payload for CAN-ID '{hex(self.mapping.canID)}'!")
+
+            if trace is not None:
+                trace.finish("invalid")
+            return
+
+        if trace is not None:
+            trace.mark("queued")
+
+        self.__queue.put((bytes(payload), time.monotonic() + self.deadline, trace))
+
+    def __sendLoop(self):
+        """
+        Sends the queued payloads one after another until the transport is stopped.
+
+        :return: Nothing
+        """
+
+        while (item := self.__queue.get()) is not None:
+            payload, expiresAt, trace = item
+
+            if trace is not None:
+                trace.mark("dequeued")
+
+            if time.monotonic() > expiresAt:
+                _logConsole(f"Dropped payload for CAN-ID '{hex(self.mapping.canID)}' because its deadline passed!")
+
+                if trace is not None:
+                    trace.finish("dropped")
+                continue
+
+            try:
+                self.__transfer(payload)
+
+                if trace is not None:
+                    trace.mark("sent")
+                    trace.finish()
+            except (CanError, TimeoutError, OverflowError) as e:
+                _logConsole(f"Failed to send {len(payload)} bytes to CAN-ID '{hex(self.mapping.canID)}': {e}")
+
+                if trace is not None:
+                    trace.finish("failed")
+
+    def __sendFrame(self, data):
+        """
+        Pads a frame to the full frame length and sends it.
+
+        :param data: The data of the frame
+        :type data: bytes | bytearray[int]
+        :return: Nothing
+        """
+
+        self._send(self.mapping.canID, data.ljust(FRAME_LENGTH, bytes([PADDING])), FLOW_CONTROL_TIMEOUT)
+
+    def __transfer(self, payload: bytes):
+        """
+        Sends a payload as a single frame or as a first frame followed by consecutive frames.
+
+        :param payload: The payload
+        :return: Nothing
+        :raises TimeoutError: if the receiver doesn't send a flow control frame in time
+        :raises OverflowError: if the receiver can't take a payload of this length
+        """
+
+        length = len(payload)
+
+        if length < FRAME_LENGTH:
+            self.__sendFrame(bytes([SINGLE_FRAME << 4 | length]) + payload)
+            return
+
+        if length <= MAX_SHORT_LENGTH:
+            header = bytes([FIRST_FRAME << 4 | length >> 8, length & 0xFF])
+        else:
+            header = bytes([FIRST_FRAME << 4, 0]) + length.to_bytes(4, byteorder="big")
+
+        offset = FRAME_LENGTH - len(header)
+
+        with self.__flowControlCondition:
+            self.__flowControl = None
+
+        self.__sendFrame(header + payload[:offset])
+
+        sequenceNumber = 1
+        while offset < length:
+            blockSize, separationTime = self.__awaitFlowControl()
+
+            sentInBlock = 0
+            while offset < length and (blockSize == 0 or sentInBlock < blockSize):
+                if sentInBlock > 0 and separationTime > 0:
+                    time.sleep(separationTime)
+
+                self.__sendFrame(
+                    bytes([CONSECUTIVE_FRAME << 4 | sequenceNumber]) + payload[offset:offset + FRAME_LENGTH - 1]
+                )
+
+                offset += FRAME_LENGTH - 1
+                sequenceNumber = (sequenceNumber + 1) & 0xF
+                sentInBlock += 1
+
+    def __awaitFlowControl(self):
+        """
+        Waits for the receiver to allow the next block of consecutive frames.
+
+        :return: A tuple of the block size and the separation time (in s) requested by the receiver
+        :raises TimeoutError: if the receiver doesn't send a flow control frame in time
+        :raises OverflowError: if the receiver can't take a payload of this length
+        """
+
+        waitFrames = 0
+
+        with self.__flowControlCondition:
+            while True:
+                if not self.__flowControlCondition.wait_for(
+                        lambda: self.__flowControl is not None, FLOW_CONTROL_TIMEOUT
+                ):
+                    raise TimeoutError("No flow control frame received!")
+
+                status, blockSize, separationTime = self.__flowControl
+                self.__flowControl = None
+
+                if status == CONTINUE_TO_SEND:
+                    return blockSize, separationTime
+
+                if status != WAIT:
+                    raise OverflowError("The receiver can't take a payload of this length!")
+
+                waitFrames += 1
+                if waitFrames > MAX_WAIT_FRAMES:
+                    raise TimeoutError(f"The receiver requested to wait more than {MAX_WAIT_FRAMES} times!")
+
+    def flowControlReceived(self, data):
+        """
+        This method is called every time the peer sent a flow control frame to the response ID of the mapping.
+
+        :param data: The data of the frame
+        :type data: bytearray[int]
+        :return: Nothing
+        """
+
+        if len(data) < 3 or data[0] >> 4 != FLOW_CONTROL:
+            return
+
+        with self.__flowControlCondition:
+            self.__flowControl = (data[0] & 0xF, data[1], decodeSeparationTime(data[2]))
+            self.__flowControlCondition.notify()
+
+    def __sendFlowControl(self, status: int):
+        """
+        Sends a flow control frame to the CAN-ID of the mapping.
+
+        :param status: The flow status, e.g. CONTINUE_TO_SEND or OVERFLOW
+        :return: Nothing
+        """
+
+        data = bytes([
+            FLOW_CONTROL << 4 | status, self.mapping.blockSize, encodeSeparationTime(self.mapping.separationTime)
+        ])
+
+        self._send(self.mapping.canID, data.ljust(FRAME_LENGTH, bytes([PADDING])), FLOW_CONTROL_TIMEOUT)
+
+    def frameReceived(self, data, timestamp: float):
+        """
+        This method is called every time the peer sent a frame to the response ID of the mapping.
+
+        :param data: The data of the frame
+        :type data: bytearray[int]
+        :param timestamp: The timestamp of the frame
+        :return: Nothing
+        """
+
+        if not data:
+            return
+
+        frameType = data[0] >> 4
+
+        if frameType == SINGLE_FRAME:
+            length = data[0] & 0xF
+            if 0 < length < len(data):
+                self.__receiving = False
+                self._onReceived(self.mapping, bytes(data[1:1 + length]), timestamp)
+        elif frameType == FIRST_FRAME and len(data) == FRAME_LENGTH:
+            self.__firstFrameReceived(data)
+        elif frameType == CONSECUTIVE_FRAME:
+            self.__consecutiveFrameReceived(data, timestamp)
+        elif frameType == FLOW_CONTROL:
+            self.flowControlReceived(data)
+
+    def __firstFrameReceived(self, data):
+        """
+        Starts the reassembly of a payload.
+
+        :param data: The data of the first frame
+        :type data: bytearray[int]
+        :return: Nothing
+        """
+
+        if self.__receiving:
+            _logConsole(f"Transfer on CAN-ID '{hex(self.mapping.canID)}' was interrupted by a new one!")
+
+        length = (data[0] & 0xF) << 8 | data[1]
+        offset = 2
+
+        if length == 0:
+            length = int.from_bytes(data[2:6], byteorder="big")
+            offset = 6
+
+        if length < FRAME_LENGTH:
+            # Payloads of this length are sent as single frames
+            return
+
+        if length > len(self.__buffer):
+            self.__receiving = False
+            _logConsole(
+                f"Rejected {length} bytes on CAN-ID '{hex(self.mapping.canID)}'! The maximum is {len(self.__buffer)}."
+            )
+            self.__sendFlowControl(OVERFLOW)
+            return
+
+        received = len(data) - offset
+        self.__view[:received] = data[offset:]
+
+        self.__receiving = True
+        self.__expectedLength = length
+        self.__receivedLength = received
+        self.__sequenceNumber = 1
+        self.__blockCount = 0
+        self.__lastFrameTime = time.monotonic()
+
+        self.__sendFlowControl(CONTINUE_TO_SEND)
+
+    def __consecutiveFrameReceived(self, data, timestamp: float):
+        """
+        Adds a consecutive frame to the payload which is being reassembled.
+
+        :param data: The data of the consecutive frame
+        :type data: bytearray[int]
+        :param timestamp: The timestamp of the frame
+        :return: Nothing
+        """
+
+        if not self.__receiving:
+            return
+
+        now = time.monotonic()
+        if now - self.__lastFrameTime > CONSECUTIVE_FRAME_TIMEOUT:
+            self.__receiving = False
+            _logConsole(f"Transfer on CAN-ID '{hex(self.mapping.canID)}' timed out!")
+            return
+
+        if data[0] & 0xF != self.__sequenceNumber:
+            self.__receiving = False
+            _logConsole(f"Transfer on CAN-ID '{hex(self.mapping.canID)}' lost a frame!")
+            return
+
+        start = self.__receivedLength
+        end = min(start + len(data) - 1, self.__expectedLength)
+        self.__view[start:end] = data[1:1 + end - start]
+
+        self.__receivedLength = end
+        self.__sequenceNumber = (self.__sequenceNumber + 1) & 0xF
+        self.__lastFrameTime = now
+
+        if end == self.__expectedLength:
+            self.__receiving = False
+            self._onReceived(self.mapping, bytes(self.__view[:end]), timestamp)
+            return
+
+        self.__blockCount += 1
+        if self.mapping.blockSize and self.__blockCount == self.mapping.blockSize:
+            self.__blockCount = 0
+            self.__sendFlowControl(CONTINUE_TO_SEND)
@@ -0,0 +1,303 @@
+import json
+import random
+import time
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds (in ms) of the histogram buckets. The last bucket catches everything above
+HISTOGRAM_BOUNDS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf")]
+
+CAN_TO_MQTT = "CAN->MQTT"
+MQTT_TO_CAN = "MQTT->CAN"
+
+# Stages which are measured from an earlier stage instead of the one marked right before them.
+# paho may report a publish as done before the publish call returns, so the acknowledgement is measured from its start
+STAGE_ORIGINS = {"acknowledged": "publishing"}
+
+
+def _logConsole(message: str):
+    """
+    Prints a message with a "[Tracer]: " prefix
+
+    :param message: The message to print
+    :return: Nothing
+    """
+
+    print(f"[Tracer]: {message}")
+
+
+class StageHistogram:
+    """Aggregates the durations between two stages of a trace"""
+
+    def __init__(self):
+        """
+        Creates an empty histogram with the buckets given by HISTOGRAM_BOUNDS.
+        """
+
+        self.buckets = [0] * len(HISTOGRAM_BOUNDS)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, duration: float):
+        """
+        Adds a duration to the histogram.
+
+        :param duration: The duration in ms
+        :return: Nothing
+        """
+
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+
+    def percentile(self, percent: float):
+        """
+        Estimates a percentile by the upper bound of the bucket it falls into.
+
+        :param percent: The percentile in the range (0, 100]
+        :return: The upper bound (in ms) of the bucket, capped at the maximum duration
+        """
+
+        threshold = self.count * percent / 100
+        seen = 0
+        for bound, amount in zip(HISTOGRAM_BOUNDS, self.buckets):
+            seen += amount
+            if seen >= threshold:
+                return min(bound, self.maximum)
+
+        return self.maximum
+
+    def __str__(self):
+        return (
+            f"n={self.count}, mean={self.total / self.count:.3f}ms, p50<={self.percentile(50):.3f}ms, "
+            f"p99<={self.percentile(99):.3f}ms, max={self.maximum:.3f}ms"
+        )
+
+
+class Trace:
+    """Records the timestamps of the stages a single sampled message passes through"""
+
+    def __init__(self, tracer, direction: str):
+        """
+        Creates a trace. Use LatencyTracer.startTrace() instead of calling this directly.
+
+        :param tracer: The LatencyTracer which aggregates the trace once it is finished
+        :param direction: Either CAN_TO_MQTT or MQTT_TO_CAN
+        """
+
+        self._tracer = tracer
+        self.direction = direction
+        self.stages = []
+
+    def mark(self, stage: str, timestamp: float = None):
+        """
+        Records that the message reached a stage.
+
+        :param stage: The name of the stage
+        :param timestamp: The time (in s since the epoch) the stage was reached. Defaults to now.
+        :return: Nothing
+        """
+
+        self.stages.append((stage, time.time() if timestamp is None else timestamp))
+
+    def finish(self, outcome: str = "ok"):
+        """
+        Ends the trace and hands it to the tracer.
+
+        :param outcome: Why the trace ended, e.g. 'ok', 'dropped' or 'failed'
+        :return: Nothing
+        """
+
+        self._tracer.finish(self, outcome)
+
+
+class LatencyTracer:
+    """Samples messages passing the Bridge and aggregates the latency between their stages"""
+
+    def __init__(self, sampleRate: float = 0.0, spanFile: str = None):
+        """
+        Creates a LatencyTracer instance.
+
+        :param sampleRate: The fraction of messages to trace in the range [0, 1]. 0 disables tracing.
+        :param spanFile: The path of a file every finished trace is appended to as a JSON line. Optional.
+        """
+
+        if sampleRate is None:
+            sampleRate = 0.0
+
+        if not 0 <= sampleRate <= 1:
+            raise ValueError(f"Invalid sample rate '{sampleRate}'! Please ensure it is in the range [0, 1]!")
+
+        self.sampleRate = sampleRate
+
+        self.__histograms = {}
+        self.__histogramLock = Lock()
+
+        self.__spanFile = None
+        if spanFile is not None and sampleRate > 0:
+            self.__spanFile = open(spanFile, "a")
+            _logConsole(f"Exporting spans to '{spanFile}'")
+
+        # Publishes which wait for paho to report them as done: mid -> trace
+        self.__awaitingAck = {}
+        # Acknowledgements which arrived while the publish call was still running: mid -> timestamp
+        self.__earlyAcks = {}
+        self.__publishing = 0
+        self.__ackLock = Lock()
+
+    def startTrace(self, direction: str, busTimestamp: float = None):
+        """
+        Decides whether a message is sampled and starts a trace for it.
+
+        :param direction: Either CAN_TO_MQTT or MQTT_TO_CAN
+        :param busTimestamp: The time (in s since the epoch) the message was put on the bus, if known.
+        :return: A Trace with the first stage marked or None, if the message isn't sampled
+        """
+
+        if self.sampleRate <= 0 or random.random() >= self.sampleRate:
+            return None
+
+        trace = Trace(self, direction)
+        if busTimestamp:
+            trace.mark("bus", busTimestamp)
+        trace.mark("received")
+
+        return trace
+
+    def tracePublish(self, trace: Trace, publish):
+        """
+        Calls the given publish function and waits for paho to report the publish as done before finishing the trace.
+
+        :param trace: The trace of the published message
+        :param publish: A function without arguments which publishes the message and returns the MQTTMessageInfo
+        :return: The result of the publish function
+        """
+
+        with self.__ackLock:
+            self.__publishing += 1
+
+        mid = None
+        try:
+            trace.mark("publishing")
+            result = publish()
+            trace.mark("published")
+
+            if result.rc == 0:
+                mid = result.mid
+
+            return result
+        finally:
+            with self.__ackLock:
+                self.__publishing -= 1
+
+                ackedAt = self.__earlyAcks.pop(mid, None)
+                if mid is not None and ackedAt is None:
+                    self.__awaitingAck[mid] = trace
+
+                if self.__publishing == 0:
+                    self.__earlyAcks.clear()
+
+            if mid is None:
+                trace.finish("failed")
+            elif ackedAt is not None:
+                trace.mark("acknowledged", ackedAt)
+                trace.finish()
+
+    def acknowledge(self, mid: int):
+        """
+        Callback for a publish paho reports as done. At QoS 0 this means it was written to the socket.
+
+        :param mid: The message ID of the publish
+        :return: Nothing
+        """
+
+        if not self.__awaitingAck and not self.__publishing:
+            return
+
+        ackedAt = time.time()
+
+        with self.__ackLock:
+            trace = self.__awaitingAck.pop(mid, None)
+
+            if trace is None:
+                if self.__publishing:
+                    self.__earlyAcks[mid] = ackedAt
+                return
+
+        trace.mark("acknowledged", ackedAt)
+        trace.finish()
+
+    def finish(self, trace: Trace, outcome: str):
+        """
+        Adds the durations between the stages of a trace to the histograms and exports the span.
+
+        :param trace: The finished trace
+        :param outcome: Why the trace ended
+        :return: Nothing
+        """
+
+        timestamps = dict(trace.stages)
+        start = trace.stages[0][1]
+        durations = []
+
+        for previous, (stage, timestamp) in zip(trace.stages, trace.stages[1:]):
+            origin = STAGE_ORIGINS.get(stage, previous[0])
+            duration = (timestamp - timestamps.get(origin, previous[1])) * 1000
+
+            # Bus timestamps of some interfaces aren't relative to the epoch, so the total starts at the reception
+            if origin == "bus" and duration < 0:
+                start = timestamp
+                continue
+
+            durations.append((f"{trace.direction} {origin}->{stage}", duration))
+
+        if outcome == "ok" and len(trace.stages) > 1:
+            end = max(timestamp for _, timestamp in trace.stages)
+            durations.append((f"{trace.direction} total", (end - start) * 1000))
+
+        with self.__histogramLock:
+            for name, duration in durations:
+                self.__histograms.setdefault(name, StageHistogram()).add(duration)
+
+            if self.__spanFile is not None:
+                self.__spanFile.write(json.dumps({
+                    "direction": trace.direction,
+                    "outcome": outcome,
+                    "stages": dict(trace.stages)
+                }) + "\n")
+
+    def summary(self):
+        """
+        Creates a readable summary of all histograms.
+
+        :return: One line per histogram
+        """
+
+        with self.__histogramLock:
+            return "\n".join([f"{' ' * 8}- {name}: {histogram}" for name, histogram in self.__histograms.items()])
+
+    def stop(self):
+        """
+        Prints the summary of the histograms and closes the span file.
+
+        :return: Nothing
+        """
+
+        if self.sampleRate <= 0:
+            return
+
+        _logConsole("Latency summary:")
+        print(self.summary())
+
+        with self.__histogramLock:
+            if self.__spanFile is not None:
+                self.__spanFile.close()
+                self.__spanFile = None
+
+        with self.__ackLock:
+            self.__awaitingAck.clear()
+            self.__earlyAcks.clear()
+
+        _logConsole("Stopped!")
@@ -1,6 +1,7 @@
 from paho.mqtt.client import Client, MQTTMessage, error_string
 
-from util import Mapping, BYTE_ORDER
+from LatencyTracer import LatencyTracer, Trace, MQTT_TO_CAN
+from util import Mapping, BYTE_ORDER, TRANSPORT_ISO_TP
 
 
 def _logConsole(message: str):
@@ -18,7 +19,8 @@ class MQTTHandler:
     """Handles the communication with the MQTT broker"""
 
     def __init__(self, sendToCAN, host: str = "localhost", port: int = 1883, username: str = "user",
-                 password: str = "admin", mappings: list[Mapping] = None):
+                 password: str = "admin", mappings: list[Mapping] = None, tracer: LatencyTracer = None,
+                 clientID: str = "Python_MQTT_Client", shareGroup: str = None, onConnected=None):
         """
         Creates an MQTT handler.
 
@@ -28,6 +30,12 @@ class MQTTHandler:
         :param username: The name of the user to login as
         :param password: The password of the given user
         :param mappings: A list of topics to subscribe to
+        :param tracer: The tracer which samples the latency of messages. Tracing is disabled if not given.
+        :param clientID: The ID of the MQTT client. Has to be unique per broker.
+        :param shareGroup: The group of a shared subscription, so the broker delivers every message to only one
+            member of the group. Optional.
+        :param onConnected: The function which will be called every time the connection to the broker is
+            established, including reconnects. Optional.
         """
 
         if host is None:
@@ -45,8 +53,19 @@ class MQTTHandler:
         if mappings is None:
             mappings = []
 
+        if tracer is None:
+            tracer = LatencyTracer()
+
+        if clientID is None:
+            clientID = "Python_MQTT_Client"
+
         self._sendToCan = sendToCAN
         self.mappings = mappings
+        self.tracer = tracer
+        self.shareGroup = shareGroup
+        self._onConnected = onConnected
+
+        self.__subscribedTopics = set()
 
         self.__hostname = host
         self.__port = port
@@ -58,7 +77,7 @@ class MQTTHandler:
         _logConsole(f"Trying to connect to MQTT Broker at '{host}:{port}' as '{username}'...")
 
         # Create the client
-        self.client = Client("Python_MQTT_Client", clean_session=True)
+        self.client = Client(clientID, clean_session=True)
         self.client.username_pw_set(username, password)
 
         # Add callbacks
@@ -67,6 +86,7 @@ class MQTTHandler:
         self.client.on_disconnect = lambda _, __, reason: _logConsole(
             f"Disconnected with reason '{reason}': {error_string(reason)}"
         )
+        self.client.on_publish = lambda _, __, mid: self.tracer.acknowledge(mid)
 
     def connect(self):
         """
@@ -94,20 +114,57 @@ class MQTTHandler:
         _logConsole("Failed to connect to broker!")
         self.abort = True
 
-    def initHandler(self):
+    def initHandler(self, mappings: list[Mapping] = None):
         """
         Initializes the handler by subscribing to the given topics.
 
+        :param mappings: The mappings whose topics should be subscribed to. Defaults to every mapping.
         :return: Nothing
         """
 
-        # Subscribe to every topic
-        for mapping in self.mappings:
-            self.client.subscribe(mapping.mqttTopic)
-            _logConsole(f"Subscribed to topic '{mapping.mqttTopic}'")
+        if mappings is None:
+            mappings = self.mappings
 
         self.client.on_message = self.__messageReceived
 
+        # The broker forgets all subscriptions of a clean session once the connection is lost
+        self.__subscribedTopics = set()
+        self.updateSubscriptions(mappings)
+
+    def updateSubscriptions(self, mappings: list[Mapping]):
+        """
+        Subscribes to the topics of the given mappings and unsubscribes from all other topics.
+
+        :param mappings: The mappings whose topics should be subscribed to
+        :return: Nothing
+        """
+
+        topics = {mapping.mqttTopic for mapping in mappings}
+
+        # Subscribe first, so no message is lost while another member of the share group takes over
+        for topic in topics - self.__subscribedTopics:
+            self.client.subscribe(self.__topicFilter(topic))
+            _logConsole(f"Subscribed to topic '{self.__topicFilter(topic)}'")
+
+        for topic in self.__subscribedTopics - topics:
+            self.client.unsubscribe(self.__topicFilter(topic))
+            _logConsole(f"Unsubscribed from topic '{self.__topicFilter(topic)}'")
+
+        self.__subscribedTopics = topics
+
+    def __topicFilter(self, topic: str):
+        """
+        Creates the filter to subscribe to a topic with.
+
+        :param topic: The MQTT topic
+        :return: The topic as a shared subscription, if a share group is set
+        """
+
+        if self.shareGroup is None:
+            return topic
+
+        return f"$share/{self.shareGroup}/{topic}"
+
     def __onConnect(self, _, __, ___, resultCode: int):
         """
         This method is called once the connection to the MQTT Broker is established.
@@ -124,6 +181,9 @@ class MQTTHandler:
             case 0:
                 _logConsole(f"Successfully connected!")
                 self.connected = True
+
+                if self._onConnected is not None:
+                    self._onConnected()
             case 5 | 7:
                 _logConsole(f"Connection failed: {error_string(resultCode)}")
                 self.abort = True
@@ -158,12 +218,19 @@ class MQTTHandler:
             # There is no way other than accessing the protected class member
             otherClientID = client._client_id.decode('utf-8')
             if otherClientID != self.client._client_id.decode('utf-8') or self.receiveOwnMessages:
+                trace = self.tracer.startTrace(MQTT_TO_CAN)
+
                 topic = message.topic
-                payload = message.payload.decode("utf-8")
+
+                # Payloads of ISO-TP mappings are forwarded as they are
+                segmented = any(
+                    [mapping.transport == TRANSPORT_ISO_TP for mapping in self.mappings if mapping.mqttTopic == topic]
+                )
+                payload = message.payload if segmented else message.payload.decode("utf-8")
 
                 _logConsole(f"Client '{otherClientID}' sent a message:")
                 print(f"{' ' * 8}- Topic: {topic}")
-                print(f"{' ' * 8}- Payload: {payload}")
+                print(f"{' ' * 8}- Payload: {f'{len(payload)} bytes' if segmented else payload}")
 
                 try:
                     # Get the corresponding canID
@@ -171,30 +238,48 @@ class MQTTHandler:
 
                     try:
                         # Convert the payload
-                        payload = int(payload).to_bytes(8, byteorder=BYTE_ORDER)
+                        if not segmented:
+                            payload = int(payload).to_bytes(8, byteorder=BYTE_ORDER)
+
+                        if trace is not None:
+                            trace.mark("routed")
 
                         _logConsole(f"This message will be forwarded to CAN-ID '{canID}'!")
-                        self._sendToCan(canID, payload)
+                        self._sendToCan(canID, payload, trace)
                     except (OverflowError, ValueError) as e:
                         _logConsole(f"Something went wrong while converting the payload into a byte-array: {e}")
+
+                        if trace is not None:
+                            trace.finish("invalid")
                 except IndexError:
                     _logConsole(f"No CAN-ID for MQTT-Topic '{topic}' found!")
+
+                    if trace is not None:
+                        trace.finish("unmapped")
         except UnicodeDecodeError as e:
             _logConsole(f"Encountered an error while trying to convert the message data: {e}")
 
-    def publishMessage(self, topic: str, payload: int):
+    def publishMessage(self, topic: str, payload, trace: Trace = None):
         """
         This method publishes a given message to the MQTT broker.
 
         :param topic: The topic the message should be published to
         :param payload: The payload of the message
+        :type payload: int | bytes
+        :param trace: The latency trace of the message, if it is sampled.
         :return: True, if the message was sent successfully
         """
 
         try:
-            _logConsole(f"Publishing message with payload '{payload}' to MQTT-Topic '{topic}'.")
-
-            result = self.client.publish(topic, payload)
+            _logConsole(
+                f"Publishing message with payload "
+                f"'{f'{len(payload)} bytes' if isinstance(payload, bytes) else payload}' to MQTT-Topic '{topic}'."
+            )
+
+            if trace is None:
+                result = self.client.publish(topic, payload)
+            else:
+                result = self.tracer.tracePublish(trace, lambda: self.client.publish(topic, payload))
 
             return result[0] == 0
         except IndexError:
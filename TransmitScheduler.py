@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import time
+from threading import Thread, Condition
+
+from can import CanError
+
+from LatencyTracer import Trace
+
+
+def _logConsole(message: str):
+    """
+    Prints a message with a "[Scheduler]: " prefix
+
+    :param message: The message to print
+    :return: Nothing
+    """
+
+    print(f"[Scheduler]: {message}")
+
+
+class TransmitScheduler:
+    """Queues outgoing CAN messages by priority and sends them on a dedicated thread"""
+
+    def __init__(self, send, defaultDeadline: float = 1.0, sendTimeout: float = 1.0):
+        """
+        Creates a TransmitScheduler instance. The sender thread is started with start().
+
+        :param send: The function which will be called to put a message on the CAN Bus.
+            Called with the CAN-ID, the payload and the timeout (in s).
+        :param defaultDeadline: The duration (in s) a message may be pending before it is dropped.
+        :param sendTimeout: The maximum duration (in s) a single send may block the sender thread.
+        """
+
+        if defaultDeadline is None:
+            defaultDeadline = 1.0
+
+        if sendTimeout is None:
+            sendTimeout = 1.0
+
+        self._send = send
+        self.defaultDeadline = defaultDeadline
+        self.sendTimeout = sendTimeout
+
+        # Heap of [priority, sequence, canID]. The sequence keeps equal priorities in FIFO order
+        self.__queue = []
+        self.__sequence = itertools.count()
+
+        # Only the newest payload per CAN-ID is kept: canID -> [payload, deadline, trace]
+        self.__pending = {}
+
+        self.__condition = Condition()
+        self.__running = False
+        self.__thread = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def start(self):
+        """
+        Starts the sender thread.
+
+        :return: Nothing
+        """
+
+        with self.__condition:
+            if self.__running:
+                return
+
+            self.__running = True
+
+        self.__thread = Thread(target=self.__sendLoop, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the sender thread. Messages still pending are discarded.
+
+        :return: Nothing
+        """
+
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+
+        try:
+            self.__thread.join()
+        except AttributeError:
+            pass
+
+        _logConsole(
+            f"Stopped! Sent: {self.sent}, dropped: {self.dropped}, coalesced: {self.coalesced}, "
+            f"failed: {self.failed}, discarded: {len(self.__pending)}"
+        )
+
+        with self.__condition:
+            self.__queue.clear()
+            self.__pending.clear()
+
+    def schedule(self, canID: int, payload, priority: int = None, deadline: float = None, trace: Trace = None):
+        """
+        Queues a message for the CAN Bus. Never blocks on the bus.
+
+        :param canID: The CAN-ID of the message
+        :param payload: The payload of the message
+        :type payload: bytearray[int] | bytes
+        :param priority: Lower values are sent first. Defaults to the CAN-ID, like the bus arbitration.
+        :param deadline: The duration (in s) after which the message is dropped if not sent yet.
+        :param trace: The latency trace of the message, if it is sampled.
+        :return: Nothing
+        """
+
+        if priority is None:
+            priority = canID
+
+        if deadline is None:
+            deadline = self.defaultDeadline
+
+        expiresAt = time.monotonic() + deadline
+
+        if trace is not None:
+            trace.mark("queued")
+
+        with self.__condition:
+            replaced = self.__pending.get(canID)
+            self.__pending[canID] = [payload, expiresAt, trace]
+
+            if replaced is None:
+                heapq.heappush(self.__queue, [priority, next(self.__sequence), canID])
+                self.__condition.notify()
+            else:
+                # The newer payload keeps the place of the older one in the queue
+                self.coalesced += 1
+
+        if replaced is not None and replaced[2] is not None:
+            replaced[2].finish("coalesced")
+
+    def __nextMessage(self):
+        """
+        Blocks until a message is pending or the scheduler is stopped.
+
+        :return: A tuple of CAN-ID, payload, deadline and trace or None, if the scheduler was stopped
+        """
+
+        with self.__condition:
+            while self.__running and not self.__queue:
+                self.__condition.wait()
+
+            if not self.__running:
+                return None
+
+            _, _, canID = heapq.heappop(self.__queue)
+            payload, expiresAt, trace = self.__pending.pop(canID)
+
+            return canID, payload, expiresAt, trace
+
+    def __sendLoop(self):
+        """
+        Sends the pending messages in priority order until the scheduler is stopped.
+
+        :return: Nothing
+        """
+
+        while (message := self.__nextMessage()) is not None:
+            canID, payload, expiresAt, trace = message
+
+            if trace is not None:
+                trace.mark("dequeued")
+
+            remaining = expiresAt - time.monotonic()
+            if remaining <= 0:
+                self.dropped += 1
+                _logConsole(f"Dropped message for CAN-ID '{hex(canID)}' because its deadline passed!")
+
+                if trace is not None:
+                    trace.finish("dropped")
+                continue
+
+            try:
+                self._send(canID, payload, min(remaining, self.sendTimeout))
+                self.sent += 1
+
+                if trace is not None:
+                    trace.mark("sent")
+                    trace.finish()
+            except (CanError, ValueError) as e:
+                self.failed += 1
+                _logConsole(f"Failed to send message to CAN-ID '{hex(canID)}': {e}")
+
+                if trace is not None:
+                    trace.finish("failed")
@@ -1,7 +1,7 @@
 import argparse
 
 from Bridge import Bridge
-from util import parseMappings, MQTTParams, CANParams
+from util import parseMappings, MQTTParams, CANParams, TraceParams, ClusterParams
 
 
 def main():
@@ -18,6 +18,19 @@ def main():
         parser.add_argument("-interface", type=str, help="interface of the CAN Bus. Defaults to 'virtual'")
         parser.add_argument("-bustype", type=str, help="interface of the CAN Bus. Defaults to 'virtual'")
         parser.add_argument("-bitrate", type=int, help="bitrate of the CAN Bus. Defaults to '500000'")
+        parser.add_argument(
+            "-deadline", type=float, help="seconds a message may be queued for the CAN Bus. Defaults to '1.0'"
+        )
+
+        parser.add_argument(
+            "-tracerate", type=float, help="fraction of messages whose latency is traced. Defaults to '0' (disabled)"
+        )
+        parser.add_argument("-tracefile", type=str, help="path to a file the latency traces are appended to")
+
+        parser.add_argument("-cluster", type=str, help="name of the bridge group to join. Enables clustered mode")
+        parser.add_argument(
+            "-instance", type=str, help="ID of this instance in the bridge group. Defaults to a random ID"
+        )
 
         parser.add_argument("-mappings", type=str, help="Path to the JSON mapping file. Defaults to 'mapping.json'")
         
@@ -38,9 +51,18 @@ def main():
                 args.channel,
                 args.interface,
                 args.bustype,
-                args.bitrate
+                args.bitrate,
+                args.deadline
+            ),
+            mappings,
+            TraceParams(
+                args.tracerate,
+                args.tracefile
             ),
-            mappings
+            ClusterParams(
+                args.cluster,
+                args.instance
+            )
         )
     except KeyboardInterrupt:
         exit(-1)
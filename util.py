@@ -1,9 +1,13 @@
 import json
+import uuid
 
 MAX_CAN_ID = 2 ** 11 - 1
 MAX_EXTENDED_CAN_ID = 2 ** 29 - 1
 BYTE_ORDER = "little"
 
+TRANSPORT_RAW = "raw"
+TRANSPORT_ISO_TP = "iso-tp"
+
 
 def parseMappings(mappingFile: str = "mapping.json"):
     """
@@ -20,8 +24,15 @@ def parseMappings(mappingFile: str = "mapping.json"):
         with open(mappingFile) as file:
             return [
                 Mapping(
-                    int(mapping["CAN-ID"], base=0) if isinstance(mapping["CAN-ID"], str) else mapping["CAN-ID"],
-                    mapping["MQTT-Topic"]
+                    _parseID(mapping["CAN-ID"]),
+                    mapping["MQTT-Topic"],
+                    mapping.get("Priority"),
+                    mapping.get("Deadline"),
+                    mapping.get("Transport"),
+                    _parseID(mapping.get("Response-ID")),
+                    mapping.get("Block-Size"),
+                    mapping.get("Separation-Time"),
+                    mapping.get("Max-Length")
                 )
                 for mapping in json.load(file)["mappings"]
             ]
@@ -33,22 +44,93 @@ def parseMappings(mappingFile: str = "mapping.json"):
     exit(1)
 
 
+def _parseID(canID):
+    """
+    Parses a CAN-ID of the mapping file.
+
+    :param canID: The CAN-ID as an integer or a (hex-)string
+    :type canID: int | str | None
+    :return: The CAN-ID as an integer or None, if none was given
+    """
+
+    return int(canID, base=0) if isinstance(canID, str) else canID
+
+
 class Mapping:
     """Represents a static data class containing information about a CAN to MQTT mapping"""
 
-    def __init__(self, canID: int, mqttTopic: str):
+    def __init__(self, canID: int, mqttTopic: str, priority: int = None, deadline: float = None,
+                 transport: str = TRANSPORT_RAW, responseID: int = None, blockSize: int = 0,
+                 separationTime: float = 0.0, maxLength: int = 4095):
         """
         Creates a static data class.
 
         :param canID: The ID of the message on the CAN-Bus
         :param mqttTopic: The name of the corresponding MQTT topic
+        :param priority: The transmit priority of messages to the CAN-Bus. Lower values are sent first.
+            Defaults to the CAN-ID.
+        :param deadline: The duration (in s) a message to the CAN-Bus may be queued before it is dropped.
+            Defaults to the deadline of the CANParams.
+        :param transport: How payloads are carried on the CAN-Bus. 'raw' for a single frame, 'iso-tp' for
+            segmented payloads of any length according to ISO 15765-2.
+        :param responseID: The CAN-ID the ISO-TP peer sends on. Data and flow control frames from the peer are
+            received on it, while the CAN-ID carries the data and flow control frames of the Bridge. Required for
+            'iso-tp'.
+        :param blockSize: The number of ISO-TP consecutive frames the sender may send before waiting for the next
+            flow control frame. 0 sends all frames without waiting.
+        :param separationTime: The minimum time (in ms) between two ISO-TP consecutive frames the sender has to keep.
+        :param maxLength: The length (in bytes) of the longest ISO-TP payload which can be received.
         """
 
+        if transport is None:
+            transport = TRANSPORT_RAW
+
+        if blockSize is None:
+            blockSize = 0
+
+        if separationTime is None:
+            separationTime = 0.0
+
+        if maxLength is None:
+            maxLength = 4095
+
         if canID > MAX_EXTENDED_CAN_ID:
             raise ValueError(f"The given CAN-ID is greater than the maximum of '{MAX_EXTENDED_CAN_ID}'!")
 
+        if priority is not None and (not isinstance(priority, int) or isinstance(priority, bool)):
+            raise ValueError(f"The given priority '{priority}' isn't an integer!")
+
+        if deadline is not None and (
+                not isinstance(deadline, (int, float)) or isinstance(deadline, bool) or deadline <= 0
+        ):
+            raise ValueError(f"The given deadline '{deadline}' isn't a positive number of seconds!")
+
+        if transport not in [TRANSPORT_RAW, TRANSPORT_ISO_TP]:
+            raise ValueError(f"Unknown transport '{transport}'! Use '{TRANSPORT_RAW}' or '{TRANSPORT_ISO_TP}'.")
+
+        if transport == TRANSPORT_ISO_TP:
+            if responseID is None or responseID > MAX_EXTENDED_CAN_ID or responseID == canID:
+                raise ValueError(f"The ISO-TP mapping of CAN-ID '{canID}' needs a separate, valid Response-ID!")
+
+            if not 0 <= blockSize <= 0xFF:
+                raise ValueError(f"The given block size '{blockSize}' isn't in the range [0, 255]!")
+
+            # Every number in this range has an STmin encoding: 100 - 900 µs below 1 ms, whole milliseconds above
+            if not isinstance(separationTime, (int, float)) or not 0 <= separationTime <= 127:
+                raise ValueError(f"The given separation time '{separationTime}' isn't in the range [0, 127] ms!")
+
+            if maxLength < 8:
+                raise ValueError(f"The given maximum length '{maxLength}' is shorter than a single CAN frame!")
+
         self.canID = canID
         self.mqttTopic = mqttTopic
+        self.priority = priority
+        self.deadline = deadline
+        self.transport = transport
+        self.responseID = responseID
+        self.blockSize = blockSize
+        self.separationTime = separationTime
+        self.maxLength = maxLength
 
 
 class MQTTParams:
@@ -85,7 +167,8 @@ class MQTTParams:
 class CANParams:
     """Param container for the CANHandler class"""
 
-    def __init__(self, channel="Virtual CAN Bus", interface="virtual", bustype="virtual", bitrate=500000):
+    def __init__(self, channel="Virtual CAN Bus", interface="virtual", bustype="virtual", bitrate=500000,
+                 deadline=1.0):
         """
         Creates a static data class.
 
@@ -93,6 +176,7 @@ class CANParams:
         :param interface: The interface of the CAN. 'virtual' for a virtual CAN Bus.
         :param bustype: The bustype. 'virtual' for a virtual CAN Bus.
         :param bitrate: The bitrate of the CAN Bus. Not needed for a virtual CAN.
+        :param deadline: The default duration (in s) a message to the CAN Bus may be queued before it is dropped.
         """
 
         if channel is None:
@@ -107,7 +191,67 @@ class CANParams:
         if bitrate is None:
             bitrate = 500000
 
+        if deadline is None:
+            deadline = 1.0
+
+        if deadline <= 0:
+            print(f"The given deadline '{deadline}' isn't a positive number of seconds!")
+            exit(1)
+
         self.channel = channel
         self.interface = interface
         self.bustype = bustype
         self.bitrate = bitrate
+        self.deadline = deadline
+
+
+class TraceParams:
+    """Param container for the LatencyTracer class"""
+
+    def __init__(self, sampleRate: float = 0.0, spanFile: str = None):
+        """
+        Creates a static data class.
+
+        :param sampleRate: The fraction of messages to trace in the range [0, 1]. 0 disables tracing.
+        :param spanFile: The path of a file every finished trace is appended to as a JSON line. Optional.
+        """
+
+        if sampleRate is None:
+            sampleRate = 0.0
+
+        if not 0 <= sampleRate <= 1:
+            print(f"The given sample rate '{sampleRate}' isn't in the range [0, 1]!")
+            exit(1)
+
+        if spanFile is not None:
+            if sampleRate == 0:
+                print(f"The span file '{spanFile}' is ignored, since tracing is disabled! Set a sample rate to use it.")
+                spanFile = None
+            else:
+                try:
+                    # Check the path now, so a bad one doesn't surface as an exception of the Bridge
+                    open(spanFile, "a").close()
+                except OSError as e:
+                    print(f"The given span file '{spanFile}' can't be written: {e}")
+                    exit(1)
+
+        self.sampleRate = sampleRate
+        self.spanFile = spanFile
+
+
+class ClusterParams:
+    """Param container for the ClusterCoordinator class"""
+
+    def __init__(self, group: str = None, instanceID: str = None):
+        """
+        Creates a static data class.
+
+        :param group: The name of the bridge group. Clustered mode is disabled if not given.
+        :param instanceID: The ID of this instance within the group. Defaults to a random ID.
+        """
+
+        if instanceID is None:
+            instanceID = uuid.uuid4().hex[:8]
+
+        self.group = group
+        self.instanceID = instanceID